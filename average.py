@@ -11,56 +11,52 @@ Options:
 
 from __future__ import print_function
 
-from colorsys import rgb_to_hsv, hsv_to_rgb
 import os
+import subprocess
 
 import docopt
-from PIL import Image
+import numpy
+from PIL import Image, ImageDraw
+
+
+# Modes which map to (height, width, channels) arrays with RGB first.
+RGB_MODES = ("RGB", "RGBA", "RGBX")
 
 
 def _strong_color(r, g, b):
-    h, s, v = rgb_to_hsv(r/256, g/256, b/256)
-    strong_color = tuple(int(round(i * 255)) for i in hsv_to_rgb(h, s, 1))
-    return strong_color
+    # Same hue and saturation at full value: brightest channel goes to 255.
+    m = max(r, g, b)
+    if m == 0:
+        return 255, 255, 255
+
+    return tuple(int(round(c * 255 / m)) for c in (r, g, b))
 
 
 def sorted_by_value(c):
-    colors_hsv = [
-        rgb_to_hsv(c[i]/256, c[i+1]/256, c[i+2]/256)
-        for i in range(0, len(c), 3)
-    ]
-    colors_hsv.sort(key=lambda hsv: 100 * hsv[2] + hsv[1])
-    result = []
-    for c in colors_hsv:
-        result.extend(
-            int(round(i * 255)) for i in hsv_to_rgb(c[0], c[1], c[2])
-        )
-    return result
+    colors = numpy.asarray(c, dtype=numpy.float64).reshape(-1, 3) / 256
+    value = colors.max(axis=1)
+    chroma = value - colors.min(axis=1)
+    saturation = numpy.divide(
+        chroma, value, out=numpy.zeros_like(value), where=value > 0
+    )
+    order = numpy.argsort(100 * value + saturation, kind='stable')
+    return (colors[order] * 255).round().astype(int).ravel().tolist()
 
 
 def simple_average(im):
-    r = g = b = 0
-    pixels = im.width * im.height
-    for y in range(im.height):
-        for x in range(im.width):
-            _r, _g, _b = im.getpixel((x, y))
-            r += _r
-            g += _g
-            b += _b
-    r = int(round(r / pixels))
-    g = int(round(g / pixels))
-    b = int(round(b / pixels))
-    return r, g, b
+    if im.mode not in RGB_MODES:
+        im = im.convert("RGB")
+    pixels = numpy.asarray(im)
+    r, g, b = pixels.reshape(-1, pixels.shape[-1])[:, :3].mean(axis=0)
+    return int(round(r)), int(round(g)), int(round(b))
 
 
 def integer_average(im):
-    value = 0
-    pixels = im.width * im.height
-    for y in range(im.height):
-        for x in range(im.width):
-            r, g, b = im.getpixel((x, y))
-            value += 2 ** 16 * r + 2 ** 8 * g + b
-    avg = int(round(value / pixels))
+    if im.mode not in RGB_MODES:
+        im = im.convert("RGB")
+    pixels = numpy.asarray(im)
+    values = pixels[..., :3].astype(numpy.int64).dot((2 ** 16, 2 ** 8, 1))
+    avg = int(round(int(values.sum()) / values.size))
     b = avg & 0xff
     g = avg >> 8 & 0xff
     r = avg >> 16 & 0xff
@@ -68,8 +64,13 @@ def integer_average(im):
 
 
 def quantize_average(im, colors=6):
-    im = im.quantize(colors=colors, method=1)
-    return list(im.getpalette()[:3*colors])
+    """Returns a flat RGB list of `colors` dominant colors in `im`.
+
+    Uses fast octree quantization which, unlike the maximum coverage method,
+    is quick on large images. The palette differs slightly between the two.
+    """
+    im = im.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+    return im.getpalette()[:3*colors]
 
 
 def gen_coords(w, h):
@@ -93,28 +94,28 @@ def main(file):
         simple = simple_average(source)
         colors.extend(simple)
         colors.extend(_strong_color(*simple))
-        resized_source = source.resize((w // 8, h // 8))
+        resized_source = source.resize(
+            (w // 8, h // 8), resample=Image.Resampling.BOX
+        )
 
     colors = sorted_by_value(colors)
 
     base_im = Image.new("RGB", (w // 4, h // 4))
 
-    coords = gen_coords(w, h)
-
-    while colors:
-        color = tuple(colors[:3])
-        color_im = Image.new("RGB", (w // 12, h // 12), color)
-        base_im.paste(color_im, next(coords))
-        colors = colors[3:]
+    draw = ImageDraw.Draw(base_im)
+    tw, th = w // 12, h // 12
+    for i, (x, y) in zip(range(0, len(colors), 3), gen_coords(w, h)):
+        color = tuple(colors[i:i + 3])
+        draw.rectangle((x, y, x + tw - 1, y + th - 1), fill=color)
 
     filepath, filebase = os.path.split(file)
     filebase, fileext = os.path.splitext(filebase)
     target_file = os.path.join(filepath, 'averages', filebase + '.png')
     with open(target_file, 'wb') as target:
         base_im.paste(resized_source, (w // 16, h // 16))
-        base_im.save(target, "png")
+        base_im.save(target, "png", compress_level=1)
 
-    os.system("open -a Pixelmator \"" + target_file + "\"")
+    subprocess.Popen(["open", "-a", "Pixelmator", target_file])
 
 
 if __name__ == '__main__':
@@ -11,58 +11,54 @@ Options:
 
 from __future__ import print_function
 
-from colorsys import rgb_to_hsv, hsv_to_rgb
+import multiprocessing
 import os
 import sys
 import warnings
 
 import docopt
-from PIL import Image, ImageFilter
+import numpy
+from PIL import Image, ImageDraw, ImageFilter
+
+
+# Modes which map to (height, width, channels) arrays with RGB first.
+RGB_MODES = ("RGB", "RGBA", "RGBX")
 
 
 def _strong_color(r, g, b):
-    h, s, v = rgb_to_hsv(r/256, g/256, b/256)
-    strong_color = tuple(int(round(i * 255)) for i in hsv_to_rgb(h, s, 1))
-    return strong_color
+    # Same hue and saturation at full value: brightest channel goes to 255.
+    m = max(r, g, b)
+    if m == 0:
+        return 255, 255, 255
+
+    return tuple(int(round(c * 255 / m)) for c in (r, g, b))
 
 
 def sorted_by_value(c):
-    colors_hsv = [
-        rgb_to_hsv(c[i]/256, c[i+1]/256, c[i+2]/256)
-        for i in range(0, len(c), 3)
-    ]
-    colors_hsv.sort(key=lambda hsv: 100 * hsv[2] + hsv[1])
-    result = []
-    for c in colors_hsv:
-        result.extend(
-            int(round(i * 255)) for i in hsv_to_rgb(c[0], c[1], c[2])
-        )
-    return result
+    colors = numpy.asarray(c, dtype=numpy.float64).reshape(-1, 3) / 256
+    value = colors.max(axis=1)
+    chroma = value - colors.min(axis=1)
+    saturation = numpy.divide(
+        chroma, value, out=numpy.zeros_like(value), where=value > 0
+    )
+    order = numpy.argsort(100 * value + saturation, kind='stable')
+    return (colors[order] * 255).round().astype(int).ravel().tolist()
 
 
 def simple_average(im):
-    r = g = b = 0
-    pixels = im.width * im.height
-    for y in range(im.height):
-        for x in range(im.width):
-            _r, _g, _b = im.getpixel((x, y))
-            r += _r
-            g += _g
-            b += _b
-    r = int(round(r / pixels))
-    g = int(round(g / pixels))
-    b = int(round(b / pixels))
-    return r, g, b
+    if im.mode not in RGB_MODES:
+        im = im.convert("RGB")
+    pixels = numpy.asarray(im)
+    r, g, b = pixels.reshape(-1, pixels.shape[-1])[:, :3].mean(axis=0)
+    return int(round(r)), int(round(g)), int(round(b))
 
 
 def integer_average(im):
-    value = 0
-    pixels = im.width * im.height
-    for y in range(im.height):
-        for x in range(im.width):
-            r, g, b = im.getpixel((x, y))
-            value += 2 ** 16 * r + 2 ** 8 * g + b
-    avg = int(round(value / pixels))
+    if im.mode not in RGB_MODES:
+        im = im.convert("RGB")
+    pixels = numpy.asarray(im)
+    values = pixels[..., :3].astype(numpy.int64).dot((2 ** 16, 2 ** 8, 1))
+    avg = int(round(int(values.sum()) / values.size))
     b = avg & 0xff
     g = avg >> 8 & 0xff
     r = avg >> 16 & 0xff
@@ -70,8 +66,13 @@ def integer_average(im):
 
 
 def quantize_average(im, colors=6):
-    im = im.quantize(colors=colors, method=1)
-    return list(im.getpalette()[:3*colors])
+    """Returns a flat RGB list of `colors` dominant colors in `im`.
+
+    Uses fast octree quantization which, unlike the maximum coverage method,
+    is quick on large images. The palette differs slightly between the two.
+    """
+    im = im.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+    return im.getpalette()[:3*colors]
 
 
 def gen_coords(w, h):
@@ -93,20 +94,18 @@ def main(file):
         simple = simple_average(source)
         colors.extend(simple)
         colors.extend(_strong_color(*simple))
-        resized_source = source.resize((170, 170), resample=Image.LANCZOS)
+        resized_source = source.resize(
+            (170, 170), resample=Image.Resampling.BOX
+        )
 
     colors = sorted_by_value(colors)
 
     base_im = Image.new("RGB", (180, 180))
 
-    coords = gen_coords(180, 180)
-
-    while colors:
-        _color = tuple(colors[:3])
-        _coords = next(coords)
-        _color_im = Image.new("RGB", (60, 60), _color)
-        base_im.paste(_color_im, _coords)
-        colors = colors[3:]
+    draw = ImageDraw.Draw(base_im)
+    for i, (x, y) in zip(range(0, len(colors), 3), gen_coords(180, 180)):
+        _color = tuple(colors[i:i + 3])
+        draw.rectangle((x, y, x + 59, y + 59), fill=_color)
 
     base_im = base_im.filter(ImageFilter.GaussianBlur(radius=10))
     base_im.paste(resized_source, (5, 5))
@@ -115,15 +114,16 @@ def main(file):
     filebase, fileext = os.path.splitext(filebase)
     target_file = os.path.join(filepath, 'avatars', filebase + '.png')
     with open(target_file, 'wb') as target:
-        base_im.save(target, "png")
+        base_im.save(target, "png", compress_level=1)
+
+    return file
 
 
 if __name__ == '__main__':
     args = docopt.docopt(__doc__)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", ResourceWarning)
-        for file in args['<file>']:
-            print('Converting {}... '.format(file), end='')
+    with multiprocessing.Pool(
+        initializer=warnings.simplefilter, initargs=("ignore", ResourceWarning)
+    ) as pool:
+        for file in pool.imap_unordered(main, args['<file>']):
+            print('Converted {}.'.format(file))
             sys.stdout.flush()
-            main(file=file)
-            print('done.')
@@ -6,24 +6,27 @@ spectro - creates a spectrogram suited for synchronized Full HD display.
 
 Usage:
     spectro [--window=WIN] [--step=STEP] [--brightness=BRI] [--fps=FPS] \
-[--width=WIDTH] [--height=HEIGHT] [--colors=COLORS] [--channels=CHANNELS] <file>
+[--width=WIDTH] [--height=HEIGHT] [--colors=COLORS] [--channels=CHANNELS] \
+[--jobs=JOBS] <file>
     spectro [--colors=COLORS] --show-palette
     spectro --help
 
 Options:
     <file>               Path to a file.
     --window=WIN         How big should a single chunk given to the FFT be. By
-                         default this is computed as 'sample_rate
-                         * bytes_per_sample' in the given audio file. Larger
+                         default this is one second of audio, computed as
+                         'sample_rate * 2' in the given audio file. Larger
                          values give more detailed images but require more
-                         computation. The value should be a positive integer.
+                         computation. The value is in bytes of 16-bit samples
+                         and should be an integer of at least 4.
     --step=STEP          How much should the window move between two consecutive
                          FFT calculations. If this value is much smaller than
                          `--window`, the resulting image is going to be wider but
                          the overlap in calculations will result in a ripple
-                         effect. The value should be a positive integer. By
-                         default this is calculated automatically based on
-                         `--window` and `--fps`.
+                         effect. The value is in bytes of 16-bit samples and
+                         should be an integer of at least 2. By default this
+                         is calculated automatically based on `--window` and
+                         `--fps`.
     --brightness=BRI     Brightness computed by this program is linear, from
                          black (when the FFT is 0) to white (when the FFT is at
                          the absolute maximum within the file). This gives quite
@@ -41,6 +44,9 @@ Options:
                          [default: #000000,#0000d0,#00a0a0,#00d000,#ffffff]
     --channels=CHANNELS  Which channels to consider in input, like: 0,1,2,3,4,5.
                          [default: ALL]
+    --jobs=JOBS          How many processes should compute FFTs.
+                         With more than one, each process runs single-threaded
+                         FFTs on its own batches of chunks. [default: 1]
     --show-palette       Don't generate a spectrogram but a palette instead.
     -h, --help           This info.
 """
@@ -52,61 +58,299 @@ from __future__ import unicode_literals
 
 
 import audiotools
-from colorsys import rgb_to_hsv, hsv_to_rgb
+from collections import deque
+from colorsys import rgb_to_hsv
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 import docopt
-from functools import lru_cache
+from functools import lru_cache, partial
+import math
 import numpy
+from numpy.lib.stride_tricks import sliding_window_view
 import os
 from PIL import Image
 import sys
 
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
 
+try:
+    from scipy import fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+
+BATCH_SIZE = 64
 CHUNK_SIZE = 1024
+COLUMN_BLOCK = 256
+PALETTE_SIZE = 4096
 BETA = 1.7952
+WISDOM_PATH = os.path.expanduser('~/.spectro_wisdom')
 
 
 @lru_cache()
 def kaiser(length):
-    """Memoized Kaiser window, saves a lot of time recomputing the same shape."""
-    return numpy.kaiser(length, BETA)
+    """Memoized float32 Kaiser window, saves recomputing the same shape."""
+    return numpy.kaiser(length, BETA).astype(numpy.float32)
+
+
+def fft_size(length):
+    """Returns the smallest FFT size not less than `length` that only has prime
+    factors up to 11.
+
+    FFT libraries handle such sizes with fast radix kernels. Other sizes, like
+    a large prime, fall back to algorithms that are many times slower.
+    """
+    if length < 1:
+        raise ValueError("Invalid FFT length: {}".format(length))
+
+    size = length
+    while True:
+        rest = size
+        for prime in (2, 3, 5, 7, 11):
+            while rest % prime == 0:
+                rest //= prime
+        if rest == 1:
+            return size
+
+        size += 1
+
+
+def rfft_plan(shape, threads=None):
+    """Returns an input buffer of `shape` and a function computing its real FFT.
+
+    When pyFFTW is installed, the FFT is a multi-threaded FFTW plan measured
+    once for the given shape and reused for every call. Single precision FFTW
+    wisdom is kept in `WISDOM_PATH` so later runs skip most of the measuring.
+    Otherwise scipy.fft is used, or numpy as a last resort. Both FFTW and scipy
+    use `threads` threads, all cores by default.
+    """
+    if pyfftw is None:
+        buffer = numpy.empty(shape, numpy.float32)
+        if scipy_fft is None:
+            return buffer, partial(numpy.fft.rfft, buffer, axis=-1)
+
+        return buffer, partial(
+            scipy_fft.rfft, buffer, axis=-1, workers=threads or -1
+        )
+
+    try:
+        with open(WISDOM_PATH, 'rb') as f:
+            pyfftw.import_wisdom((b'', f.read(), b''))
+    except OSError:
+        pass
+    buffer = pyfftw.empty_aligned(shape, numpy.float32)
+    plan = pyfftw.builders.rfft(
+        buffer,
+        axis=-1,
+        overwrite_input=True,
+        avoid_copy=True,
+        planner_effort='FFTW_MEASURE',
+        threads=threads or os.cpu_count(),
+    )
+    try:
+        # worker processes plan at the same time, readers must never see
+        # a partially written file
+        partial_path = '{}.{}'.format(WISDOM_PATH, os.getpid())
+        with open(partial_path, 'wb') as f:
+            f.write(pyfftw.export_wisdom()[1])
+        os.replace(partial_path, WISDOM_PATH)
+    except OSError:
+        pass
+    return plan.input_array, plan
+
+
+def make_room(data, cursor, end, count):
+    """Returns `data`, `cursor` and `end` adjusted for `count` more samples.
+
+    Samples before `cursor` are dropped and pending ones are moved to the front
+    of the buffer. Only if that's not enough, a bigger buffer is allocated.
+    """
+    if end + count <= data.shape[1]:
+        return data, cursor, end
+
+    start = min(cursor, end)
+    pending = end - start
+    if pending + count > data.shape[1]:
+        grown = numpy.zeros((data.shape[0], 2 * (pending + count)), data.dtype)
+        grown[:, :pending] = data[:, start:end]
+        data = grown
+    else:
+        data[:, :pending] = data[:, start:end]
+    return data, cursor - start, pending
 
 
-def bytes_from_pcm(pcm, window, step, channels):
-    """Yields byte chunks of `window` size from the `pcm` stream.
+def chunk_offsets(first, count, step):
+    """Returns offsets of chunks `first` to `first + count` from the start of
+    chunk `first`. The last offset is where the chunk after them starts.
 
-    Data is padded on both ends with half a window. This way both the first and
-    the last FFT is computed against the first and the last sample in the audio
-    file.
+    Chunk `k` starts at sample `floor(k * step)` so a fractional `step` never
+    drifts by more than a sample, however long the stream.
     """
-    first_ch = channels[0]
-    _padding = b'\x00' * window
-    data = {ch: _padding for ch in channels}
+    starts = numpy.arange(first, first + count + 1) * step
+    starts = numpy.floor(starts).astype(numpy.intp)
+    return starts - starts[0]
+
+
+def samples_from_pcm(pcm, window, step, channels, batch=1):
+    """Yields sample spans covering up to `batch` chunks of `window` size from
+    the `pcm` stream, consecutive chunks being `step` samples apart, along
+    with the chunks' `starts` within the span.
+
+    `step` may be fractional, see `chunk_offsets()`. For a whole number of
+    samples `starts` is a slice, otherwise an array of indexes.
+
+    Data is padded on both ends with a window of silence. This way both the
+    first and the last FFT is computed against the first and the last sample in
+    the audio file.
+
+    Spans are int16 views of shape (channels, samples) into a buffer that's
+    reused, they're only valid until the next one is requested.
+    """
+    def starts(count):
+        if float(step).is_integer():
+            return slice(None, None, int(step))
+
+        return offsets[:count]
+
+    span = math.ceil((batch - 1) * step) + window
+    data = numpy.zeros((len(channels), 2 * span + CHUNK_SIZE), numpy.int16)
+    cursor = 0
+    end = window
+    chunk = 0
+    offsets = chunk_offsets(chunk, batch, step)
     frames = pcm.read(CHUNK_SIZE)
     while len(frames):
-        for ch in channels:
-            data[ch] += frames.channel(ch).to_bytes(False, True)
-        while len(data[first_ch]) >= window:
-            yield [data[ch][:window] for ch in channels]
-            for ch in channels:
-                data[ch] = data[ch][step:]
+        data, cursor, end = make_room(data, cursor, end, frames.frames)
+        samples = numpy.frombuffer(frames.to_bytes(False, True), numpy.int16)
+        samples = samples.reshape(frames.frames, pcm.channels)
+        for row, ch in enumerate(channels):
+            data[row, end:end + frames.frames] = samples[:, ch]
+        end += frames.frames
+        while end - cursor >= offsets[batch - 1] + window:
+            span = data[:, cursor:cursor + offsets[batch - 1] + window]
+            yield span, starts(batch)
+            cursor += offsets[batch]
+            chunk += batch
+            offsets = chunk_offsets(chunk, batch, step)
         frames = pcm.read(CHUNK_SIZE)
-    for ch in channels:
-        data[ch] += _padding
-    while len(data[first_ch]) >= window:
-        yield [data[ch][:window] for ch in channels]
-        for ch in channels:
-            data[ch] = data[ch][step:]
+    data, cursor, end = make_room(data, cursor, end, window)
+    data[:, end:end + window] = 0
+    end += window
+    while end - cursor >= window:
+        count = numpy.count_nonzero(offsets[:batch] + window <= end - cursor)
+        span = data[:, cursor:cursor + offsets[count - 1] + window]
+        yield span, starts(count)
+        cursor += offsets[count]
+        chunk += count
+        offsets = chunk_offsets(chunk, batch, step)
+
+
+@lru_cache()
+def spectrum_plan(length, threads=None):
+    """Memoized Kaiser window and `rfft_plan()` for batches of chunks of
+    `length` samples. The buffer is shared by all callers within a process.
+    """
+    shape = (BATCH_SIZE, fft_size(length))
+    return (kaiser(length),) + rfft_plan(shape, threads)
+
+
+def spectrum(span, length, starts, threads=None):
+    """Returns real FFTs of chunks of `length` samples beginning at `starts`
+    in `span`.
+
+    `span` is an int16 array of shape (channels, samples) covering at most
+    `BATCH_SIZE` chunks. `starts` is a slice, which windows a strided view of
+    the samples, or an array of indexes, which copies the chunks. Channels are
+    averaged and chunks are zero-padded to `fft_size()` so awkward window
+    sizes don't hit slow FFT paths. The result has one row per chunk and may
+    be reused by the next call.
+    """
+    weights, windowed, rfft = spectrum_plan(length, threads)
+    if len(span) == 1:
+        # the multiply below converts int16 samples to float32 on the fly
+        data = span[0]
+    else:
+        data = span.mean(axis=0, dtype=numpy.float32)
+    chunks = sliding_window_view(data, length)[starts]
+    numpy.multiply(chunks, weights, out=windowed[:len(chunks), :length])
+    if windowed.shape[1] > length:
+        # FFTW may overwrite its input so the padding is reset every time
+        windowed[:len(chunks), length:] = 0
+    return rfft()[:len(chunks)]
 
 
 def freq_from_pcm(pcm, window, step, channels):
-    """Yields real FFTs from data chunks of `window` size in `pcm` stream."""
+    """Yields real FFTs from data chunks of `window` size in `pcm` stream.
+
+    `window` and `step` are given in bytes of 16-bit samples, `step` may be
+    fractional. FFTs are computed for `BATCH_SIZE` chunks at a time and
+    yielded as 2-D arrays with one row per chunk. Yielded arrays may be reused
+    by the next batch, copy them to keep them.
+    """
+    length = window // 2
+    spans = samples_from_pcm(pcm, length, step / 2, channels, BATCH_SIZE)
+    for span, starts in spans:
+        yield spectrum(span, length, starts)
 
-    for chunks in bytes_from_pcm(pcm, window, step, channels):
-        data = numpy.zeros(window // 2, numpy.int64)
-        for chunk in chunks:
-            data += numpy.frombuffer(chunk, 'int16')
-        data //= len(channels)
-        yield numpy.fft.rfft(data * kaiser(len(data)))
+
+def magnitudes(freqs, half, height):
+    """Returns `(mantissas, scales, minimum, maximum, total)` of the magnitudes
+    in the first `half` bins of `freqs`.
+
+    Only the real part is used, truncated to an integer. The first `height`
+    bins are stored as 16-bit mantissas with one scale per column, half the
+    memory of int32 while staying well within a palette step. The minimum,
+    maximum and total cover all `half` bins.
+    """
+    block = numpy.empty((len(freqs), half), 'int32')
+    numpy.abs(freqs.real[:, :half], out=block, casting='unsafe')
+    cropped = block[:, :height]
+    scales = numpy.maximum(cropped.max(axis=1), 1) / 0xffff
+    mantissas = numpy.rint(cropped / scales[:, numpy.newaxis])
+    return (
+        mantissas.astype('uint16'),
+        scales,
+        int(block.min()),
+        int(block.max()),
+        int(block.sum(dtype=numpy.int64)),
+    )
+
+
+def spectrum_magnitudes(span, length, starts, half, height):
+    """`magnitudes()` of the `spectrum()` of `span`, run in worker processes.
+    """
+    freqs = spectrum(span, length, starts, threads=1)
+    return magnitudes(freqs, half, height)
+
+
+def magnitudes_from_pcm(pcm, window, step, channels, half, height, jobs=1):
+    """Yields `magnitudes()` of consecutive batches of FFTs from `pcm` stream.
+
+    With `jobs` above 1, the FFTs and magnitudes are computed by as many worker
+    processes while the stream is decoded here. Only a few batches per worker
+    are in flight at any time so memory use doesn't grow with the file.
+    """
+    if jobs == 1:
+        for freqs in freq_from_pcm(pcm, window, step, channels):
+            yield magnitudes(freqs, half, height)
+        return
+
+    length = window // 2
+    spans = samples_from_pcm(pcm, length, step / 2, channels, BATCH_SIZE)
+    pending = deque()
+    with ProcessPoolExecutor(jobs) as pool:
+        for span, starts in spans:
+            # spans are reused by the reader while submissions are pickled
+            pending.append(pool.submit(
+                spectrum_magnitudes, span.copy(), length, starts, half, height
+            ))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 def convert_html_to_hsv(colors):
@@ -142,61 +386,97 @@ def convert_channels_to_list(channels):
     return [int(elem.strip()) for elem in channels.split(",")]
 
 
+@dataclass(frozen=True)
+class ColorBuckets:
+    """Evenly spaced bucket edges and their HSV colors as parallel arrays.
+
+    `slopes` hold the HSV change per unit of value between consecutive buckets
+    so interpolating doesn't need a division per sample.
+    """
+
+    edges: numpy.ndarray
+    colors: numpy.ndarray
+    slopes: numpy.ndarray
+
+
 def colors_to_buckets(colors, min=0, max=1):
     step = (max - min) / (len(colors) - 1)
-    newcolors = []
-    for i in range(len(colors)):
-        newcolors.append((min + i * step, colors[i]))
-    return tuple(newcolors)
+    edges = min + numpy.arange(len(colors)) * step
+    colors = numpy.array(colors)
+    slopes = numpy.diff(colors, axis=0) / numpy.diff(edges)[:, numpy.newaxis]
+    return ColorBuckets(edges=edges, colors=colors, slopes=slopes)
 
 
 def get_color(value, brightness, color_buckets):
-    value *= brightness  # assuming signal is between 0.0 and 1.0
+    """Returns the RGB triplet for a single `value`, see `get_colors`."""
+    return tuple(get_colors(value, brightness, color_buckets).tolist())
+
 
-    last_bucket = None
-    last_color = None
-    transition = 0
-    for curr_bucket, curr_color in color_buckets:
-        if curr_bucket >= value:
-            if last_bucket is not None:
-                transition = (value - last_bucket) / (curr_bucket - last_bucket)
-            else:
-                last_color = curr_color
-            break
+def get_colors(values, brightness, color_buckets):
+    """Returns an array of RGB triplets for `values` between 0.0 and 1.0.
 
-        last_bucket = curr_bucket
-        last_color = curr_color
+    Each value is multiplied by `brightness` and interpolated in HSV between
+    the two neighboring buckets, clamped to the first and the last color.
+    """
+    edges = color_buckets.edges
+    values = numpy.clip(values * brightness, edges[0], edges[-1])
+    # index of the last bucket below each value, the first one for the minimum
+    lower = numpy.searchsorted(edges, values).clip(1, len(edges) - 1) - 1
+    offset = (values - edges[lower])[..., numpy.newaxis]
+    hsv = color_buckets.colors[lower] + offset * color_buckets.slopes[lower]
+    return hsv_array_to_rgb(hsv[..., 0], hsv[..., 1], hsv[..., 2])
 
-    h = last_color[0] + transition * (curr_color[0] - last_color[0])
-    s = last_color[1] + transition * (curr_color[1] - last_color[1])
-    v = last_color[2] + transition * (curr_color[2] - last_color[2])
-    return tuple(int(round(255 * c)) for c in hsv_to_rgb(h, s, v))
+
+def get_palette(color_buckets, size=PALETTE_SIZE):
+    """Returns a lookup table of `size` RGB triplets evenly covering 0.0 - 1.0.
+
+    Indexing it with values scaled to `size - 1` replaces the bucket search and
+    HSV conversion of `get_colors` with a single gather.
+    """
+    return get_colors(numpy.linspace(0, 1, size), 1, color_buckets)
+
+
+def hsv_array_to_rgb(h, s, v):
+    """Vectorized `colorsys.hsv_to_rgb`, returns an array of uint8 triplets."""
+    i = (h * 6).astype(numpy.int64)
+    f = h * 6 - i
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+    i %= 6
+    rgb = numpy.stack(
+        [
+            numpy.choose(i, [v, q, p, p, t, v]),
+            numpy.choose(i, [t, v, v, q, p, p]),
+            numpy.choose(i, [p, p, t, v, v, q]),
+        ],
+        axis=-1,
+    )
+    return (rgb * 255).round().astype(numpy.uint8)
 
 
 def show_palette(colors):
     print('computing palette with colors:', colors)
     colors = convert_html_to_hsv(colors)
     color_buckets = colors_to_buckets(colors, min=0, max=1)
-    print('buckets:', color_buckets)
-    rgb = numpy.zeros((1000, 1000, 3), 'uint8')
-    for x in range(1000):
-        point = x / 1000
-        color = get_color(point, 1, color_buckets)
-        if x % 10 == 0:
-            print("{:.3f}".format(point), color)
-        for y in range(1000):
-            rgb[y, x] = color
+    buckets = zip(color_buckets.edges.tolist(), color_buckets.colors.tolist())
+    print('buckets:', tuple((edge, tuple(color)) for edge, color in buckets))
+    points = numpy.arange(1000) / 1000
+    palette = get_colors(points, 1, color_buckets)
+    for point, color in zip(points[::10], palette[::10].tolist()):
+        print("{:.3f}".format(point), tuple(color))
+    rgb = numpy.repeat(palette[numpy.newaxis], 1000, axis=0)
     print('creating in-memory PNG image')
     i = Image.fromarray(rgb, mode='RGB')
     img_path = '_palette.png'
     print('saving image to', img_path)
-    i.save(img_path)
+    i.save(img_path, compress_level=3)
 
 
 
 def main(
     file, window=None, step=None, brightness=8, prepend=0, fps=30,
-    crop_height=1080, colors=None, channels=None
+    crop_height=1080, colors=None, channels=None, jobs=1
 ):
     minimum = None
     maximum = None
@@ -214,53 +494,66 @@ def main(
     channels = convert_channels_to_list(channels)
 
     audiofile = audiotools.open(file)
-    freq_samples = []
     with audiofile.to_pcm() as pcm:
-        _bytes_per_sample = pcm.bits_per_sample // 8
+        _source_bits = pcm.bits_per_sample
+        if _source_bits != 16:
+            # samples are read as int16, other depths are converted on the fly
+            pcm = audiotools.PCMConverter(
+                pcm, pcm.sample_rate, pcm.channels, pcm.channel_mask, 16
+            )
+        _bytes_per_sample = 2
         _samples_per_second = pcm.sample_rate * _bytes_per_sample
         window = window or _samples_per_second
-        step = step or int(round(_samples_per_second / fps))
+        # not rounded, columns stay in sync with the video however long
+        step = step or _samples_per_second / fps
         channels = channels or list(range(pcm.channels))
 
         print(file)
         print('     duration:', float(audiofile.seconds_length()))
         print('  sample rate:', pcm.sample_rate)
-        print('         bits:', pcm.bits_per_sample)
+        print('         bits:', _source_bits)
         print('     channels:', pcm.channels)
         print('       window:', window)
-        print('         step:', step, '(fps: {})'.format(fps))
+        print('         step:', '{:g}'.format(step), '(fps: {})'.format(fps))
         print('Calculating FFT...', end='\r')
 
-        for freq in freq_from_pcm(pcm, window, step, channels):
-            half = 0
-            for modifier in [16, 12, 8, 4, 2]:
-                half = int(len(freq) / modifier)
-                if half >= crop_height:
-                    break
-            width += 1
-
-            height = max(height, half)
-            _avg = 0
-            _sample = numpy.zeros(half, 'int32')
-            for y, f in enumerate(freq):
-                if y >= half:
-                    break
-
-                v = abs(int(f.real))
-                if minimum is None or v < minimum:
-                    minimum = v
-                if maximum is None or v > maximum:
-                    maximum = v
-                _avg += v
-                _sample[y] = v
-            average += _avg / len(freq)
-            freq_samples.append(_sample)
-
+        # one FFT per step over the file padded with half a window each side
+        _padded_frames = audiofile.total_frames() + window // 2
+        estimated_width = int(_padded_frames / (step / 2)) + 1
+        bins = fft_size(window // 2) // 2 + 1
+        half = 0
+        for modifier in [16, 12, 8, 4, 2]:
+            half = int(bins / modifier)
+            if half >= crop_height:
+                break
+        if not half:
+            raise ValueError("Window too small: {}".format(window))
+        height = min(half, crop_height)
+        samples = numpy.zeros((estimated_width, height), 'uint16')
+        scales = numpy.zeros(estimated_width, 'float32')
+        columns = magnitudes_from_pcm(
+            pcm, window, step, channels, half, height, jobs
+        )
+        for block, block_scales, _min, _max, total in columns:
+            if width + len(block) > len(samples):
+                new_width = 2 * width + len(block)
+                samples = numpy.resize(samples, (new_width, height))
+                scales = numpy.resize(scales, new_width)
+
+            if minimum is None or _min < minimum:
+                minimum = _min
+            if maximum is None or _max > maximum:
+                maximum = _max
+            average += total / bins
+            samples[width:width + len(block)] = block
+            scales[width:width + len(block)] = block_scales
+            width += len(block)
+
+    samples = samples[:width]
+    scales = scales[:width]
     average = int(round(average / width))
-    if height > crop_height:
-        height = crop_height
-    threshold = maximum - minimum
-    rgb = numpy.zeros((height, width + prepend, 3), 'uint8')
+    # silent input has no range at all, don't divide by zero painting it
+    threshold = maximum - minimum or 1
 
     print('  image width:', width)
     print(' image height:', height)
@@ -269,21 +562,35 @@ def main(
     print('Applying colors...', end='\r')
 
     custom_black = get_color(0, brightness, color_buckets)
-    for x in range(prepend):
-        for y in range(height):
-            rgb[y, x] = custom_black
-
-    for x, freq in enumerate(freq_samples, prepend):
-        freq = freq[:height]
-        for y, f in enumerate(reversed(freq)):
-            f /= threshold
-            rgb[y, x] = get_color(f, brightness, color_buckets)
+    i = Image.new('RGB', (width + prepend, height), custom_black)
+
+    palette = get_palette(color_buckets)
+    scale = brightness * (len(palette) - 1) / threshold
+    # tiles are small enough for the intermediates to stay in the CPU cache;
+    # pixels are gathered top row first so PIL gets them without another copy
+    levels = numpy.empty((height, COLUMN_BLOCK), 'float32')
+    indexes = numpy.empty((height, COLUMN_BLOCK), numpy.intp)
+    pixels = numpy.empty(height * COLUMN_BLOCK * 3, 'uint8')
+    for x in range(0, width, COLUMN_BLOCK):
+        block = samples[x:x + COLUMN_BLOCK, ::-1].T
+        columns = block.shape[1]
+        numpy.multiply(
+            block, scales[x:x + COLUMN_BLOCK] * scale, out=levels[:, :columns]
+        )
+        numpy.rint(
+            levels[:, :columns], out=indexes[:, :columns], casting='unsafe'
+        )
+        rgb = pixels[:height * columns * 3].reshape(height, columns, 3)
+        # clipping saturates levels past the end at the last palette color
+        numpy.take(palette, indexes[:, :columns], axis=0, out=rgb, mode='clip')
+        block_im = Image.frombuffer(
+            'RGB', (columns, height), rgb, 'raw', 'RGB', 0, 1
+        )
+        i.paste(block_im, (prepend + x, 0))
 
-    print('Creating in-memory PNG image', end='\r')
-    i = Image.fromarray(rgb, mode='RGB')
     img_path = os.path.basename(file) + '.png'
     print('Saving image to', img_path, ' ' * 10, end='\r')
-    i.save(img_path)
+    i.save(img_path, compress_level=3)
     print('Saved image to', img_path, ' ' * 10)
 
 
@@ -293,6 +600,7 @@ if __name__ == '__main__':
         '--brightness',
         '--fps',
         '--height',
+        '--jobs',
         '--step',
         '--width',
         '--window',
@@ -308,6 +616,21 @@ if __name__ == '__main__':
                 file=sys.stderr,
             )
             sys.exit(1)
+
+        # in bytes, a step needs one 16-bit sample and a window two
+        least = {'--step': 2, '--window': 4}.get(arg)
+        if least and args[arg] < least:
+            print(
+                'error: {} value must be at least {}'.format(arg, least),
+                file=sys.stderr,
+            )
+            sys.exit(1)
+    if args['--jobs'] < 1:
+        print(
+            'error: --jobs value not a valid positive integer',
+            file=sys.stderr,
+        )
+        sys.exit(1)
     if args['--show-palette']:
         show_palette(
             colors=args['--colors'],
@@ -323,4 +646,5 @@ if __name__ == '__main__':
             fps=args['--fps'],
             colors=args['--colors'],
             channels=args['--channels'],
+            jobs=args['--jobs'],
         )